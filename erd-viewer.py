@@ -4,24 +4,56 @@ Creation Date: Nov 2021
 Company:       XtractPro Software
 """
 
-import os, sys, re, json
+import os, sys, re, json, time
+import contextlib, functools
 import argparse
 import configparser
 import snowflake.connector
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
+# style values for each built-in theme (cfillcolor is the fill color for collapsed shapes)
+THEME_STYLES = {
+    "Common Gray": {
+        "shape": "Mrecord", "style": "rounded",
+        "color": "#6c6c6c", "bgcolor": "#e0e0e0", "fillcolor": "#f5f5f5", "cfillcolor": "#e0e0e0",
+        "icolor": "#000000", "tcolor": "#000000", "pencolor": "#696969", "penwidth": "1" },
+    "Blue Navy": {
+        "shape": "Mrecord", "style": "rounded",
+        "color": "#1a5282", "bgcolor": "#1a5282", "fillcolor": "#ffffff", "cfillcolor": "#1a5282",
+        "icolor": "#000000", "tcolor": "#ffffff", "pencolor": "#0078d7", "penwidth": "2" },
+    "Gradient Green": {
+        "shape": "Mrecord", "style": "rounded",
+        "color": "#716f64", "bgcolor": "transparent", "fillcolor": "#008080:#ffffff", "cfillcolor": "#008080:#ffffff",
+        "icolor": "#000000", "tcolor": "#000000", "pencolor": "#696969", "penwidth": "1" },
+    "Blue Sky": {
+        "shape": "Mrecord", "style": "rounded",
+        "color": "#716f64", "bgcolor": "transparent", "fillcolor": "#d3dcef:#ffffff", "cfillcolor": "#d3dcef:#ffffff",
+        "icolor": "#000000", "tcolor": "#000000", "pencolor": "#696969", "penwidth": "1" },
+    "Common Gray Box": {
+        "shape": "record", "style": "rounded",
+        "color": "#6c6c6c", "bgcolor": "#e0e0e0", "fillcolor": "#f5f5f5", "cfillcolor": "#e0e0e0",
+        "icolor": "#000000", "tcolor": "#000000", "pencolor": "#696969", "penwidth": "1" },
+}
+
+IDENTIFIER_RE = re.compile(r"\A[A-Z_0-9]*\Z")
+
+@functools.lru_cache(maxsize=None)
 def getName(name):
-    return name.lower() if re.match("^[A-Z_0-9]*$", name) != None else f'"{name}"'
+    return name.lower() if IDENTIFIER_RE.match(name) != None else f'"{name}"'
 
 class Table:
     """
     Database table, with columns, primary keys and foreign keys, as constraints
     """
     
+    __slots__ = ("name", "qname", "comment", "label", "columns", "uniques", "pks", "fks", "_columns_by_name")
+
     def __init__(self, name, comment):
         self.name = name
+        self.qname = getName(name)  # name as used in SQL statements
         self.comment = comment
         self.label = None
 
@@ -29,126 +61,116 @@ class Table:
         self.uniques = {}           # dictionary with UNIQUE constraints, by name + list of columns
         self.pks = []               # list of PK columns (if any)
         self.fks = {}               # dictionary with FK constraints, by name + list of FK columns
+        self._columns_by_name = {}  # dictionary with all columns, by name (for fast lookups)
 
     def getColumn(self, name):
-        for column in self.columns:
-            if column.name == name:
-                return column
-        return None
-
-    def getUniques(self, name):
-        constraint = self.uniques[name]
-        uniques = [getName(column.name) for column in constraint]
+        return self._columns_by_name.get(name)
+
+    # outputs the table as a JSON-serializable dictionary, with constraints as lists of column names
+    def toDict(self):
+        return {
+            "name": self.name,
+            "comment": self.comment,
+            "label": self.label,
+            "columns": [column.toDict() for column in self.columns],
+            "uniques": {name: [column.name for column in constraint] for name, constraint in self.uniques.items()},
+            "pks": [column.name for column in self.pks],
+            "fks": {name: [column.name for column in constraint] for name, constraint in self.fks.items()} }
+
+    def getUniques(self, constraint):
+        uniques = [column.qname for column in constraint]
         ulist = ", ".join(uniques)
         return f",\n  unique ({ulist})"
 
     def getPKs(self):
-        pks = [getName(column.name) for column in self.pks]
+        pks = [column.qname for column in self.pks]
         pklist = ", ".join(pks)
         return f",\n  primary key ({pklist})"
 
-    def getFKs(self, name):
-        constraint = self.fks[name]
+    def getFKs(self, constraint):
         pktable = constraint[0].fkof.table
 
-        fks = [getName(column.name) for column in constraint]
+        fks = [column.qname for column in constraint]
         fklist = ", ".join(fks)
-        pks = [getName(column.fkof.name) for column in constraint]
+        pks = [column.fkof.qname for column in constraint]
         pklist = ", ".join(pks)
-        return (f"alter table {getName(self.name)}\n"
-            + f"  add foreign key ({fklist}) references {getName(pktable.name)} ({pklist});\n\n")
+        return (f"alter table {self.qname}\n"
+            + f"  add foreign key ({fklist}) references {pktable.qname} ({pklist});\n\n")
 
     # outputs a CREATE TABLE statement for the current table
     def getCreateTable(self):
-        s = f"create or replace table {getName(self.name)} ("
-        
-        first = True
-        for column in self.columns:
-            if first: first = False
-            else: s += ","
-            s += column.getCreateColumn()
+        parts = [f"create or replace table {self.qname} ("]
+        parts.append(",".join(column.getCreateColumn() for column in self.columns))
 
         if len(self.uniques) > 0:
-            for constraint in self.uniques:
-                s += self.getUniques(constraint)
+            for constraint in self.uniques.values():
+                parts.append(self.getUniques(constraint))
         if len(self.pks) >= 2:
-            s += self.getPKs()
+            parts.append(self.getPKs())
         
-        s += "\n)"
+        parts.append("\n)")
         if self.comment != '':
             comment = self.comment.replace("'", "''")
-            s += f" comment = '{comment}'"
-        return s + ";\n\n"
-
-    def getDotShape(self, theme, isFull, isCollapsed):
-        color = fillcolor = bgcolor = "transparent"
-        icolor = tcolor = "#000000"
-        style = "rounded"
-        if theme == "Common Gray" or theme == "Common Gray Box":
-            color = "#6c6c6c"
-            bgcolor = "#e0e0e0"
-            fillcolor = "#f5f5f5" if not isCollapsed else bgcolor
-        elif theme == "Blue Navy":
-            color = "#1a5282"
-            bgcolor = "#1a5282"
-            fillcolor = "#ffffff" if not isCollapsed else bgcolor
-            tcolor = "#ffffff"
-        elif theme == "Gradient Green":
-            color = "#716f64"
-            bgcolor = "transparent"
-            fillcolor = "#008080:#ffffff"
-        elif theme == "Blue Sky":
-            color = "#716f64"
-            bgcolor = "transparent"
-            fillcolor = "#d3dcef:#ffffff"
-
-        colspan = "2" if isFull else "1"
-        s = (f'  {self.label} [\n'
-            + f'    fillcolor="{fillcolor}" color="{color}" penwidth="1"\n'
-            + f'    label=<<table style="{style}" border="0" cellborder="0" cellspacing="0" cellpadding="1">\n'
-            + f'      <tr><td bgcolor="{bgcolor}" align="center" colspan="{colspan}"><font color="{tcolor}"><b>{self.name}</b></font></td></tr>\n')
-
-        if isFull or not isCollapsed:
-            for column in self.columns:
-                name = column.name
-                if column.ispk: name = f"<u>{name}</u>"
-                if column.fkof != None: name = f"<i>{name}</i>"
-                if column.nullable: name = f"{name}*"
-                if column.identity: name = f"{name} I"
-                if column.isunique: name = f"{name} U"
-
-                if isFull:
-                    s += (f'      <tr><td align="left"><font color="{icolor}">{name}&nbsp;</font></td>\n'
-                        + f'        <td align="left"><font color="{icolor}">{column.datatype}</font></td></tr>\n')
-                else:
-                    s += f'      <tr><td align="left"><font color="{icolor}">{name}</font></td></tr>\n'
-
-        return s + '    </table>>\n  ]\n'
-
-    def getDotLinks(self, theme):
-        pencolor = "#696969"
-        penwidth = "1"
-        if theme == "Blue Navy":
-            pencolor = "#0078d7"
-            penwidth = "2"
-
-        s = ""
-        for constraint in self.fks:
-            fks = self.fks[constraint]
+            parts.append(f" comment = '{comment}'")
+        return "".join(parts) + ";\n\n"
+
+    # outputs the DOT shapes for the (relationships, full, columns) variants, in one pass over the columns
+    def getDotShapeVariants(self, st):
+        color, bgcolor = st["color"], st["bgcolor"]
+        icolor, tcolor, style = st["icolor"], st["tcolor"], st["style"]
+
+        def header(fillcolor, colspan):
+            return (f'  {self.label} [\n'
+                f'    fillcolor="{fillcolor}" color="{color}" penwidth="1"\n'
+                f'    label=<<table style="{style}" border="0" cellborder="0" cellspacing="0" cellpadding="1">\n'
+                f'      <tr><td bgcolor="{bgcolor}" align="center" colspan="{colspan}"><font color="{tcolor}"><b>{self.name}</b></font></td></tr>\n')
+
+        footer = '    </table>>\n  ]\n'
+        relationships = header(st["cfillcolor"], "1") + footer
+        full = [header(st["fillcolor"], "2")]
+        columns = [header(st["fillcolor"], "1")]
+
+        # theme-dependent row fragments, around the column name and data type
+        cellStart = f'      <tr><td align="left"><font color="{icolor}">'
+        fullMiddle = f'&nbsp;</font></td>\n        <td align="left"><font color="{icolor}">'
+        rowEnd = '</font></td></tr>\n'
+
+        for column in self.columns:
+            # PKs underlined, FKs in italic, then nullable/identity/unique markers
+            isfk = column.fkof != None
+            name = (f'{"<i>" if isfk else ""}{"<u>" if column.ispk else ""}{column.name}'
+                f'{"</u>" if column.ispk else ""}{"</i>" if isfk else ""}'
+                f'{"*" if column.nullable else ""}{" I" if column.identity else ""}{" U" if column.isunique else ""}')
+
+            full.append(f'{cellStart}{name}{fullMiddle}{column.datatype}{rowEnd}')
+            columns.append(f'{cellStart}{name}{rowEnd}')
+
+        full.append(footer)
+        columns.append(footer)
+        return relationships, "".join(full), "".join(columns)
+
+    def getDotLinks(self, st):
+        pencolor, penwidth = st["pencolor"], st["penwidth"]
+
+        parts = []
+        for fks in self.fks.values():
             fk1 = fks[0]
             dashed = "" if not fk1.nullable else ' style="dashed"'
             arrow = "" if fk1.ispk and len(self.pks) == len(fk1.fkof.table.pks) else ' arrowtail="crow"'
-            s += f'  {self.label} -> {fk1.fkof.table.label} [ penwidth="{penwidth}" color="{pencolor}"{dashed}{arrow} ]\n'
-        return s
+            parts.append(f'  {self.label} -> {fk1.fkof.table.label} [ penwidth="{penwidth}" color="{pencolor}"{dashed}{arrow} ]\n')
+        return "".join(parts)
 
 class Column:
     """
     Database table column, with data type, nullable, identity, FK of
     """
     
+    __slots__ = ("table", "name", "qname", "comment", "nullable", "datatype", "identity", "isunique", "ispk", "fkof")
+
     def __init__(self, table, name, comment):
         self.table = table
         self.name = name
+        self.qname = getName(name)  # name as used in SQL statements
         self.comment = comment
         self.nullable = True
         self.datatype = None        # with (length, or precision/scale)
@@ -158,6 +180,18 @@ class Column:
         self.ispk = False
         self.fkof = None            # points to the PK column on the other side
 
+    # outputs the column as a JSON-serializable dictionary, with the FK column as [table name, column name]
+    def toDict(self):
+        return {
+            "name": self.name,
+            "comment": self.comment,
+            "nullable": self.nullable,
+            "datatype": self.datatype,
+            "identity": self.identity,
+            "isunique": self.isunique,
+            "ispk": self.ispk,
+            "fkof": None if self.fkof == None else [self.fkof.table.name, self.fkof.name] }
+
     # outputs the column definition in a CREATE TABLE statement, for the parent table
     def getCreateColumn(self):
         nullable = "" if self.nullable or (self.ispk and len(self.table.pks) == 1) else " not null"
@@ -168,64 +202,103 @@ class Column:
         if comment != '':
             comment = f" comment '{comment}'"
 
-        return f"\n  {getName(self.name)} {self.datatype}{nullable}{identity}{pk}{comment}"
+        return f"\n  {self.qname} {self.datatype}{nullable}{identity}{pk}{comment}"
+
+# SQL data type names, by (type, fixed) in the JSON data type descriptor
+DATATYPE_NAMES = {
+    ("FIXED", None): "NUMBER", ("FIXED", False): "NUMBER", ("FIXED", True): "NUMBER",
+    ("TEXT", False): "VARCHAR", ("TEXT", True): "CHAR" }
+
+# shorter aliases of some data types with precision/scale
+DATATYPE_ALIASES = { "TIMESTAMP_NTZ(9)": "TIMESTAMP", "INT(38)": "INT" }
+
+def renderLength(dtype, datatype):
+    return f"{dtype}({str(datatype['length'])})"
+
+def renderScale(dtype, datatype):
+    if int(datatype['precision']) == 0:
+        dtype = f"{dtype}({str(datatype['scale'])})"
+    elif int(datatype['scale']) == 0:
+        if dtype == "NUMBER": dtype = "INT"
+        dtype = f"{dtype}({str(datatype['precision'])})"
+    else:
+        dtype = f"{dtype}({str(datatype['precision'])},{str(datatype['scale'])})"
+        #if dtype.startswith("NUMBER("):
+        #    dtype = f"FLOAT({str(datatype['precision'])},{str(datatype['scale'])})"
+    return DATATYPE_ALIASES.get(dtype, dtype)
+
+# data type renderers, by the length/scale properties found in the JSON data type descriptor
+DATATYPE_RENDERERS = {
+    frozenset(): lambda dtype, datatype: dtype,
+    frozenset({"length"}): renderLength,
+    frozenset({"scale"}): renderScale,
+    frozenset({"length", "scale"}): renderLength }
+
+@functools.lru_cache(maxsize=None)
+def parseDataType(desc):
+    """
+    Converts a JSON data type descriptor from SHOW COLUMNS into (data type, nullable).
+    Cached, as most columns share just a few distinct descriptors.
+    """
+
+    datatype = json.loads(desc)
+    dtype = DATATYPE_NAMES.get((datatype["type"], datatype.get("fixed")), datatype["type"])
+    render = DATATYPE_RENDERERS[frozenset(datatype.keys() & {"length", "scale"})]
+    return render(dtype, datatype).lower(), bool(datatype["nullable"])
+
+def fetchAsync(con, qid):
+    """
+    Waits for a submitted query, then streams its result rows, with no full list in memory.
+    """
+
+    while con.is_still_running(con.get_query_status_throw_if_error(qid)):
+        time.sleep(0.1)
+    with con.cursor() as cur:
+        cur.get_results_from_sfqid(qid)
+        yield from cur
+
+def fetchAllAsync(cur, queries):
+    """
+    Submits all queries at once, then returns iterators over their results, in order.
+    """
+
+    qids = []
+    for query in queries:
+        cur.execute_async(query)
+        qids.append(cur.sfqid)
+    return [fetchAsync(cur.connection, qid) for qid in qids]
 
 def importMetadata(tables, cur):
     """
     Loads info about tables and relationships from a Snowflake database schema.
     """
 
+    # run all SHOW statements concurrently
+    (tableRows, columnRows, uniqueRows, pkRows, fkRows) = fetchAllAsync(cur, [
+        "show tables", "show columns", "show unique keys",
+        "show primary keys", "show imported keys" ])
+
     # get tables
-    results = cur.execute("show tables").fetchall()
-    for row in results:
+    for row in tableRows:
         name = str(row[1])
         table = Table(name, str(row[5]))
         tables[name] = table
         table.label = f"n{len(tables)}"
 
     # get table columns
-    results = cur.execute("show columns").fetchall()
-    for row in results:
+    for row in columnRows:
         name = str(row[2])
         table = tables[str(row[0])]
         column = Column(table, name, str(row[8]))
         table.columns.append(column)
+        table._columns_by_name[name] = column
         column.identity = str(row[10]) != ''
 
         # get and convert column data type
-        datatype = json.loads(str(row[3]))
-        column.datatype = datatype["type"]
-        column.nullable = bool(datatype["nullable"])
-
-        if column.datatype == "FIXED":
-            column.datatype = "NUMBER"
-        elif "fixed" in datatype:
-            fixed = bool(datatype["fixed"])
-            if column.datatype == "TEXT":
-                column.datatype = "CHAR" if fixed else "VARCHAR"
-
-        if "length" in datatype:
-            column.datatype += f"({str(datatype['length'])})"
-        elif "scale" in datatype:
-            if int(datatype['precision']) == 0:
-                column.datatype += f"({str(datatype['scale'])})"
-                if column.datatype == "TIMESTAMP_NTZ(9)":
-                    column.datatype = "TIMESTAMP"
-            elif "scale" in datatype and int(datatype['scale']) == 0:
-                column.datatype += f"({str(datatype['precision'])})"
-                if column.datatype == "NUMBER(38)":
-                    column.datatype = "INT"
-                elif column.datatype.startswith("NUMBER("):
-                    column.datatype = f"INT({str(datatype['precision'])})"
-            elif "scale" in datatype:
-                column.datatype += f"({str(datatype['precision'])},{str(datatype['scale'])})"
-                #if column.datatype.startswith("NUMBER("):
-                #    column.datatype = f"FLOAT({str(datatype['precision'])},{str(datatype['scale'])})"
-        column.datatype = column.datatype.lower()
+        column.datatype, column.nullable = parseDataType(str(row[3]))
         
     # get UNIQUE constraints
-    results = cur.execute("show unique keys").fetchall()
-    for row in results:
+    for row in uniqueRows:
         table = tables[str(row[3])]
         column = table.getColumn(str(row[4]))
 
@@ -236,19 +309,21 @@ def importMetadata(tables, cur):
         table.uniques[constraint].append(column)
         column.isunique = True
 
-    # get PKs
-    results = cur.execute("show primary keys").fetchall()
-    for row in results:
+    # get PKs (rows may come in any order, so collect their positions and sort once)
+    pkPositions = {}
+    for row in pkRows:
         table = tables[str(row[3])]
         column = table.getColumn(str(row[4]))
         column.ispk = True
 
         pos = int(row[5]) - 1
-        table.pks.insert(pos, column)
+        pkPositions.setdefault(table, []).append((pos, column))
+    for table, positions in pkPositions.items():
+        positions.sort(key=lambda position: position[0])
+        table.pks = [column for _, column in positions]
 
     # get FKs
-    results = cur.execute("show imported keys").fetchall()
-    for row in results:
+    for row in fkRows:
         pktable = tables[str(row[3])]
         pkcolumn = pktable.getColumn(str(row[4]))
         fktable = tables[str(row[7])]
@@ -266,73 +341,150 @@ def importMetadata(tables, cur):
             fkcolumn.fkof = pkcolumn
             #print(f"{fktable.name}.{fkcolumn.name} -> {pktable.name}.{pkcolumn.name}")
 
-def dumpCreateScript(s, tables, filename):
+def saveMetadata(tables, filename):
     """
-    Dump all, as CREATE TABLE statements, on screen and to SQL script file
+    Saves all tables and relationships into a JSON metadata cache file
     """
 
-    s += ";\n\n"
-    for name in tables:
-        s += tables[name].getCreateTable()
-    for name in tables:
-        for constraint in tables[name].fks:
-            s += tables[name].getFKs(constraint)
-    print(s)
-
     with open(filename, "w") as file:
-        file.write(s)
+        json.dump([table.toDict() for table in tables.values()], file)
 
-def dumpDotERD(tables, theme, filename):
+def loadMetadata(tables, filename):
     """
-    Dump all, as GraphViz ERD, on screen and to DOT file
+    Loads all tables and relationships from a JSON metadata cache file
     """
 
-    isCollapsed = filename.endswith("-relationships")
-    isFull = filename.endswith("-full") 
-
-    shape = "Mrecord"
-    if " Box" in theme:
-        shape = "record"
-
-    s = ('# You may copy and paste all this to http://viz-js.com/\n\n'
-        + 'digraph G {\n'
-        + '  graph [ rankdir="LR" bgcolor="#ffffff" ]\n'
-        + f'  node [ style="filled" shape="{shape}" gradientangle="180" ]\n'
-        + '  edge [ arrowhead="none" arrowtail="none" dir="both" ]\n\n')
-
-    for name in tables:
-        s += tables[name].getDotShape(theme, isFull, isCollapsed)
-    s += "\n"
-    for name in tables:
-        s += tables[name].getDotLinks(theme)
-    s += "}\n"
-    print(s)
-
-    # save as DOT file
-    with open(f"{filename}.dot", "w") as file:
-        file.write(s)
-
-    # with d3-graphviz
-    # https://bl.ocks.org/magjac/4acffdb3afbc4f71b448a210b5060bca
-    # https://github.com/magjac/d3-graphviz#creating-a-graphviz-renderer
-    s = ('<!DOCTYPE html><html>\n'
-        + '<head><meta charset="utf-8"></head>\n'
-        + '<body>'
-        + '<script src="https://d3js.org/d3.v5.min.js"></script>\n'
-        + '<script src="https://unpkg.com/@hpcc-js/wasm@0.3.11/dist/index.min.js"></script>\n'
-        + '<script src="https://unpkg.com/d3-graphviz@3.0.5/build/d3-graphviz.js"></script>\n'
-        + '<div id="graph" style="text-align: center;"></div>\n'
-        + '<script>\n'
-        + 'var graphviz = d3.select("#graph").graphviz()\n'
-        + '   .on("initEnd", () => { graphviz.renderDot(d3.select("#digraph").text()); });\n'
-        + '</script>\n'
-        + '<textarea id="digraph" style="display:none; height:0px;">\n'
-        + s
-        + '</textarea></body></html>')
-
-    # save as HTML file
-    with open(f"{filename}.html", "w") as file:
-        file.write(s)
+    with open(filename, "r") as file:
+        data = json.load(file)
+
+    # get tables and columns
+    for t in data:
+        table = Table(t["name"], t["comment"])
+        tables[table.name] = table
+        table.label = t["label"]
+        for c in t["columns"]:
+            column = Column(table, c["name"], c["comment"])
+            table.columns.append(column)
+            table._columns_by_name[column.name] = column
+            column.nullable = c["nullable"]
+            column.datatype = c["datatype"]
+            column.identity = c["identity"]
+            column.isunique = c["isunique"]
+            column.ispk = c["ispk"]
+
+    # get constraints, and reconnect FK columns, once all tables are there
+    for t in data:
+        table = tables[t["name"]]
+        table.uniques = {name: [table.getColumn(c) for c in constraint] for name, constraint in t["uniques"].items()}
+        table.pks = [table.getColumn(c) for c in t["pks"]]
+        table.fks = {name: [table.getColumn(c) for c in constraint] for name, constraint in t["fks"].items()}
+        for c in t["columns"]:
+            if c["fkof"] != None:
+                table.getColumn(c["name"]).fkof = tables[c["fkof"][0]].getColumn(c["fkof"][1])
+
+def dumpCreateScript(s, tables, filename, verbose=False):
+    """
+    Dump all, as CREATE TABLE statements, streamed to SQL script file (and on screen, if verbose)
+    """
+
+    with open(filename, "w", buffering=1 << 20) as file:
+        def write(chunk):
+            file.write(chunk)
+            if verbose:
+                print(chunk, end="")
+
+        write(s)
+        write(";\n\n")
+        for table in tables.values():
+            write(table.getCreateTable())
+        for table in tables.values():
+            for constraint in table.fks.values():
+                write(table.getFKs(constraint))
+    if verbose:
+        print()
+
+# with d3-graphviz
+# https://bl.ocks.org/magjac/4acffdb3afbc4f71b448a210b5060bca
+# https://github.com/magjac/d3-graphviz#creating-a-graphviz-renderer
+HTML_PROLOGUE = ('<!DOCTYPE html><html>\n'
+    '<head><meta charset="utf-8"></head>\n'
+    '<body>'
+    '<script src="https://d3js.org/d3.v5.min.js"></script>\n'
+    '<script src="https://unpkg.com/@hpcc-js/wasm@0.3.11/dist/index.min.js"></script>\n'
+    '<script src="https://unpkg.com/d3-graphviz@3.0.5/build/d3-graphviz.js"></script>\n'
+    '<div id="graph" style="text-align: center;"></div>\n'
+    '<script>\n'
+    'var graphviz = d3.select("#graph").graphviz()\n'
+    '   .on("initEnd", () => { graphviz.renderDot(d3.select("#digraph").text()); });\n'
+    '</script>\n'
+    '<textarea id="digraph" style="display:none; height:0px;">\n')
+HTML_EPILOGUE = '</textarea></body></html>'
+
+def dumpAllDotERDs(tables, theme, filename, verbose=False):
+    """
+    Dump all, as GraphViz ERDs for relationships, full and columns models, in one pass,
+    streamed to DOT and HTML files (and on screen, if verbose)
+    """
+
+    # theme styles, same for all tables
+    st = THEME_STYLES.get(theme, THEME_STYLES["Common Gray"])
+    shape = st["shape"]
+    prefix = ('# You may copy and paste all this to http://viz-js.com/\n\n'
+        'digraph G {\n'
+        '  graph [ rankdir="LR" bgcolor="#ffffff" ]\n'
+        f'  node [ style="filled" shape="{shape}" gradientangle="180" ]\n'
+        '  edge [ arrowhead="none" arrowtail="none" dir="both" ]\n\n')
+
+    filenames = [f"{filename}-relationships", f"{filename}-full", f"{filename}-columns"]
+    with contextlib.ExitStack() as stack:
+        dots = [stack.enter_context(open(f"{name}.dot", "w", buffering=1 << 20)) for name in filenames]
+        htmls = [stack.enter_context(open(f"{name}.html", "w", buffering=1 << 20)) for name in filenames]
+
+        # each DOT chunk goes to both the DOT file and within the HTML file
+        def write(i, chunk):
+            dots[i].write(chunk)
+            htmls[i].write(chunk)
+        def writeAll(chunk):
+            for i in range(len(filenames)):
+                write(i, chunk)
+
+        for html in htmls:
+            html.write(HTML_PROLOGUE)
+        writeAll(prefix)
+
+        # shapes are different for each model, links are the same
+        for table in tables.values():
+            for i, variant in enumerate(table.getDotShapeVariants(st)):
+                write(i, variant)
+        writeAll("\n")
+        for table in tables.values():
+            writeAll(table.getDotLinks(st))
+        writeAll("}\n")
+
+        for html in htmls:
+            html.write(HTML_EPILOGUE)
+
+    if verbose:
+        for name in filenames:
+            with open(f"{name}.dot", "r") as file:
+                print(file.read())
+
+@functools.lru_cache(maxsize=1)
+def loadPrivateKey(path):
+    """
+    Loads a PEM private key file and converts it to DER bytes, only once per path
+    """
+
+    with open(path, "rb") as key:
+        p_key= serialization.load_pem_private_key(
+            key.read(),
+            password = None, # os.environ['SNOWFLAKE_PASSPHRASE'].encode(),
+            backend = default_backend()
+        )
+    return p_key.private_bytes(
+        encoding = serialization.Encoding.DER,
+        format = serialization.PrivateFormat.PKCS8,
+        encryption_algorithm = serialization.NoEncryption())
 
 def connect(connect_mode, account, user, role, warehouse, database, schema):
     # (a) connect to Snowflake with SSO
@@ -361,17 +513,7 @@ def connect(connect_mode, account, user, role, warehouse, database, schema):
 
     # (c) connect to Snowflake with key-pair
     if connect_mode == "KEY-PAIR":
-        with open(f"{str(Path.home())}/.ssh/id_rsa_snowflake_demo", "rb") as key:
-            p_key= serialization.load_pem_private_key(
-                key.read(),
-                password = None, # os.environ['SNOWFLAKE_PASSPHRASE'].encode(),
-                backend = default_backend()
-            )
-        pkb = p_key.private_bytes(
-            encoding = serialization.Encoding.DER,
-            format = serialization.PrivateFormat.PKCS8,
-            encryption_algorithm = serialization.NoEncryption())
-
+        pkb = loadPrivateKey(f"{str(Path.home())}/.ssh/id_rsa_snowflake_demo")
         return snowflake.connector.connect(
             account = account,
             user = user,
@@ -387,6 +529,13 @@ def main(argv):
     Main entry point of the CLI
     """
 
+    argparser = argparse.ArgumentParser(description="Entity-Relationship diagram viewer for Snowflake models")
+    argparser.add_argument("--verbose", action="store_true",
+        help="also print the generated SQL script and DOT models on screen")
+    argparser.add_argument("--refresh", action="store_true",
+        help="always load metadata from Snowflake, ignoring any metadata cache file")
+    args = argparser.parse_args()
+
     # connect to Snowflake
     parser = configparser.ConfigParser()
     parser.read("profiles_db.conf")
@@ -400,32 +549,38 @@ def main(argv):
     schema = parser.get(section, "schema")
 
     theme = parser.get(section, "theme", fallback="Common Gray")
-    if theme not in [ "Common Gray", "Blue Navy",
-        "Gradient Green", "Blue Sky", "Common Gray Box" ]:
+    if theme not in THEME_STYLES:
         theme = "Common Gray"
 
-    # change this to connect in a different way: SSO / PWD / KEY-PAIR
-    connect_mode = "PWD"
-    con = connect(connect_mode, account, user, role, warehouse, database, schema)
-    cur = con.cursor()
-
-    # establish context for all SHOW statements
+    # reuse the metadata cache file, if newer than the profile file
     s = f"use schema {getName(database)}.{getName(schema)}"
-    cur.execute(s)
-
-    # load metadata
     tables = {}
-    importMetadata(tables, cur)
-
-    con.close()
-
-    # dump all, as CREATE TABLE statements, on screen and to SQL file
-    dumpCreateScript(s, tables, f"output/{database}.{schema}.sql")
-
-    # dump all, as GraphViz ERD, on screen and to DOT file
-    dumpDotERD(tables, theme, f"output/{database}.{schema}-relationships")
-    dumpDotERD(tables, theme, f"output/{database}.{schema}-full")
-    dumpDotERD(tables, theme, f"output/{database}.{schema}-columns")
+    cache = Path(f"output/{database}.{schema}.cache.json")
+    if (not args.refresh and cache.exists()
+        and cache.stat().st_mtime > Path("profiles_db.conf").stat().st_mtime):
+        loadMetadata(tables, cache)
+    else:
+        # change this to connect in a different way: SSO / PWD / KEY-PAIR
+        connect_mode = "PWD"
+        with connect(connect_mode, account, user, role, warehouse, database, schema) as con, con.cursor() as cur:
+
+            # establish context for all SHOW statements
+            cur.execute(s)
+
+            # load metadata, with the same cursor
+            importMetadata(tables, cur)
+        saveMetadata(tables, cache)
+
+    # dump the SQL script and the ERDs concurrently, as they only read the tables
+    # (one after the other when verbose, not to mix their output on screen)
+    with ThreadPoolExecutor(max_workers=1 if args.verbose else 2) as executor:
+        futures = [
+            # dump all, as CREATE TABLE statements, to SQL file
+            executor.submit(dumpCreateScript, s, tables, f"output/{database}.{schema}.sql", args.verbose),
+            # dump all, as GraphViz ERDs, to DOT and HTML files
+            executor.submit(dumpAllDotERDs, tables, theme, f"output/{database}.{schema}", args.verbose) ]
+        for future in futures:
+            future.result()
 
 if __name__ == "__main__":
     main('')